@@ -3,19 +3,35 @@
 # python --version
 # Python 3.11.6
 
+import re
 from contextlib import contextmanager
 from dataclasses import dataclass
-from re import sub
+from io import StringIO
+from operator import attrgetter
+from pathlib import Path
+from pickle import HIGHEST_PROTOCOL, dump, load
+from sys import stdout
 from typing import Optional
 
 import pandas as pd
-from requests import head
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+from urllib3.util import Retry
 
 # Links to the main MDN resources
 MDN = "https://developer.mozilla.org"
 MDN_ELEMENTS = f"{MDN}/en-US/docs/Web/HTML/Element"
 MDN_ATTRIBUTES = f"{MDN}/en-US/docs/Web/HTML/Attributes"
 
+# Where the MDN responses and parsed pages are cached between runs.
+CACHE_DIR = Path.home() / ".cache" / "wasmide"
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+# Session used to download the MDN pages, retrying on transient failures.
+# Responses are cached on disk for a day, to avoid hitting MDN again on each run.
+session = CachedSession(str(CACHE_DIR / "mdn_cache"), backend="sqlite", expire_after=86400)
+session.mount("https://", HTTPAdapter(max_retries=Retry(total=2, backoff_factor=0.2)))
+
 # The header of the generated rust file.
 HEADER = f"""// Programmatically generated by scripts/html-codegen.py, do not edit manually.
 
@@ -86,27 +102,45 @@ ATTRIBUTE_RENAME_OVERRIDE = {
 
 # =============================================================================
 
-# Formats a link from a route on MDN, testing if the link is still valid.
-def format_link(mdn_route: Optional[str]) -> str:
-    MISSING = "*Missing MDN documentation.*"
+# Reads the tables of an MDN page containing some text matching the given regex, reusing the
+# ones parsed by a previous run if the page did not change since, according to its ETag.
+# The download itself is already cached by the session, this only saves the lxml parse.
+def read_tables(url: str, page: str, match: str) -> list[pd.DataFrame]:
+    res = session.get(url, timeout=30)
+    res.raise_for_status()
 
-    if mdn_route is None:
-        return MISSING
+    etag = res.headers.get("ETag")
+    path = CACHE_DIR / f"{page}.pkl"
 
-    # Get HTTP header of the page and check that it is 200 OK.
-    full_link = f"{MDN}{mdn_route}"
-    res = head(full_link)
+    if etag is not None:
+        try:
+            with path.open("rb") as file:
+                cached_key, tables = load(file)
+            if cached_key == (etag, match):
+                return tables
+        except Exception:
+            # A missing, truncated or incompatible pickle is simply a cache miss.
+            pass
 
-    # If any error occured, simply return a generic message instead of the link.
-    if res.status_code == 200:
-        return f"[MDN documentation.]({full_link})"
-    else:
-        return MISSING
+    tables = pd.read_html(StringIO(res.text), extract_links="all", flavor="lxml", match=match)
+
+    with path.open("wb") as file:
+        dump(((etag, match), tables), file, HIGHEST_PROTOCOL)
+
+    return tables
+
+# Formats a link from a route on MDN. The routes are scraped from hyperlinks on MDN itself,
+# so they are not checked again.
+def format_link(mdn_route: Optional[str]) -> str:
+    if mdn_route is None:
+        return "*Missing MDN documentation.*"
+
+    return f"[MDN documentation.]({MDN}{mdn_route})"
 
 # =============================================================================
 
 # Scraped data about an element.
-@dataclass
+@dataclass(slots=True)
 class Element:
     # Original HTML name in angle brackets: <element>
     name: str
@@ -131,7 +165,6 @@ def make_element(name, mdn_route, desc, deprecated):
     rust_name = name[1:-1]
     rust_link = f"[`{rust_name}`]"
 
-    global elements
     elements[name] = Element(
         name,
         desc,
@@ -152,14 +185,15 @@ def extract_element(row, deprecated):
     else:
         make_element(name, mdn_route, desc, deprecated)
 
-tables = pd.read_html(MDN_ELEMENTS, extract_links="all")
+# Only the tables listing elements as <element>, the last one being the deprecated elements.
+tables = read_tables(MDN_ELEMENTS, "elements", r"^<[a-z]")
 for table in tables[:-1]:
     table.apply(extract_element, axis="columns", deprecated=False)
 tables[-1].apply(extract_element, axis="columns", deprecated=True)
 
 # =============================================================================
 
-@dataclass
+@dataclass(slots=True)
 class Attribute:
     name: str
     desc: str
@@ -173,7 +207,7 @@ class Attribute:
 attributes = {}
 
 def extract_attribute(row):
-    (name, mdn_route), (elements, _), (desc, _) = row
+    (name, mdn_route), (possible_elements, _), (desc, _) = row
 
     name, *warnings = name.replace("  ", " ").split(" ")
     deprecated = any([warning.lower() == "deprecated" for warning in warnings])
@@ -183,14 +217,14 @@ def extract_attribute(row):
 
     link = format_link(mdn_route)
 
-    if elements == "Global attribute":
-        elements = None
+    if possible_elements == "Global attribute":
+        possible_elements = None
     else:
-        elements = list(elements.replace("  ", " ").split(", "))
+        possible_elements = list(possible_elements.replace("  ", " ").split(", "))
 
-    content_editable = elements is not None and "contenteditable" in elements
+    content_editable = possible_elements is not None and "contenteditable" in possible_elements
     if content_editable:
-        elements.remove("contenteditable")
+        possible_elements.remove("contenteditable")
 
     if (override := ATTRIBUTE_RENAME_OVERRIDE.get(name)) is not None:
         rust_name = override
@@ -204,7 +238,6 @@ def extract_attribute(row):
     else:
         desc = desc.replace("  ", " ")
 
-    global attributes
     attributes[name] = Attribute(
         name,
         desc,
@@ -212,42 +245,44 @@ def extract_attribute(row):
         link,
         rust_name,
         rust_link,
-        elements,
+        possible_elements,
         content_editable,
     )
 
-tables = pd.read_html(MDN_ATTRIBUTES, extract_links="all")
+# Only the table listing attributes, the only one with "Global attribute" cells.
+tables = read_tables(MDN_ATTRIBUTES, "attributes", r"^Global attribute$")
 tables[0].apply(extract_attribute, axis="columns")
 
 # =============================================================================
 
 # Make elements link to attributes.
+# Global attributes can be applied to any element.
+global_attributes = [attr.name for attr in attributes.values() if attr.possible_elements is None]
+for elem in elements.values():
+    elem.possible_attributes = list(global_attributes)
+
+# Other attributes can be applied to specific elements.
 for attr in attributes.values():
-    if attr.possible_elements is None:
-        # Can be applied to any element.
-        for elem in elements.values():
-            elem.possible_attributes.append(attr.name)
-    else:
-        # Can be applied to specific elements.
+    if attr.possible_elements is not None:
         for elem_name in attr.possible_elements:
             elements[elem_name].possible_attributes.append(attr.name)
 
 # =============================================================================
 
-# Sort possible elements and attributes alphabetically.
+# Sort possible elements and attributes alphabetically, without duplicates.
 for attr in attributes.values():
     if attr.possible_elements is not None:
-        attr.possible_elements = [elements[name].rust_link for name in attr.possible_elements]
-        attr.possible_elements.sort()
+        attr.possible_elements = sorted({elements[name].rust_link for name in attr.possible_elements})
 for elem in elements.values():
-    elem.possible_attributes = [attributes[name].rust_link for name in elem.possible_attributes]
-    elem.possible_attributes.sort()
+    elem.possible_attributes = sorted({attributes[name].rust_link for name in elem.possible_attributes})
 
 # =============================================================================
 
 # Replace elements name in angles brackets by their rust links.
-IN_ANGLED_BRACKETS = r"<(.+?)>"
-REPLACE_FN = lambda x: f"{elements[x.group()].rust_link}"
+IN_ANGLED_BRACKETS = re.compile(r"<(.+?)>")
+
+def replace_fn(match: re.Match) -> str:
+    return elements[match.group()].rust_link
 
 for dic in [attributes, elements]:
     for name, obj in dic.items():
@@ -255,41 +290,41 @@ for dic in [attributes, elements]:
             # Special case for manifest atribute.
             obj.desc = obj.desc.replace("<link rel=\"manifest\">", "`<link rel=\"manifest\">`")
         else:
-            obj.desc = sub(IN_ANGLED_BRACKETS, REPLACE_FN, obj.desc)
+            obj.desc = IN_ANGLED_BRACKETS.sub(replace_fn, obj.desc)
 
 # =============================================================================
 
 # Sort attributes and elements by name.
-key = lambda x: x.rust_name
-attributes = sorted(attributes.values(), key=key)
-elements = sorted(elements.values(), key=key)
+key = attrgetter("rust_name")
+sorted_attrs = sorted(attributes.values(), key=key)
+sorted_elems = sorted(elements.values(), key=key)
 
 # =============================================================================
 
+# The generated rust file is written to this buffer, then to stdout all at once.
+buf = StringIO()
+
 # Opens a rust macro call.
 @contextmanager
 def macro_call(macro_name: str):
-    print(macro_name + "! {")
+    buf.write(macro_name + "! {\n")
     yield
-    print("}")
+    buf.write("}\n")
 
-def print_doc(doc: list[str]):
-    for line in doc:
-        if line:
-            line = " " + line
-        print(f"    ///{line}")
+# Formats lines of documentation as a rust doc comment, without trailing spaces on empty lines.
+def format_doc(doc: list[str]) -> str:
+    return "\n".join("    /// " + line if line else "    ///" for line in doc) + "\n"
 
 # =============================================================================
 
-print(HEADER)
+buf.write(HEADER + "\n")
 
 with macro_call("attributes"):
-    for attr in attributes:
+    for attr in sorted_attrs:
         doc = [
             attr.desc,
             "",
-            f"Corresponds to the HTML attribute: `{attr.name}`."
-            "",
+            f"Corresponds to the HTML attribute: `{attr.name}`.",
             "",
         ]
         if attr.possible_elements is not None:
@@ -299,16 +334,16 @@ with macro_call("attributes"):
             doc.append("Global attribute: can be applied to any HTML element.")
         doc.append("")
         doc.append(attr.mdn_link)
-        print_doc(doc)
+        buf.write(format_doc(doc))
 
         if attr.deprecated:
-            print("    #[deprecated = \"This HTML attribute is deprecated in the latest standard.\"]")
-        print(f"    {attr.rust_name} => \"{attr.name}\",")
+            buf.write("    #[deprecated = \"This HTML attribute is deprecated in the latest standard.\"]\n")
+        buf.write(f"    {attr.rust_name} => \"{attr.name}\",\n")
 
-print()
+buf.write("\n")
 
 with macro_call("elements"):
-    for elem in elements:
+    for elem in sorted_elems:
         possible_attributes = ", ".join(elem.possible_attributes)
         doc = [
             elem.desc,
@@ -319,8 +354,10 @@ with macro_call("elements"):
             "",
             elem.mdn_link
         ]
-        print_doc(doc)
+        buf.write(format_doc(doc))
 
         if elem.deprecated:
-            print("    #[deprecated = \"This HTML element is deprecated in the latest standard.\"]")
-        print(f"    {elem.rust_name} => \"{elem.rust_name}\",")
+            buf.write("    #[deprecated = \"This HTML element is deprecated in the latest standard.\"]\n")
+        buf.write(f"    {elem.rust_name} => \"{elem.rust_name}\",\n")
+
+stdout.write(buf.getvalue())